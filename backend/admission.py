@@ -0,0 +1,229 @@
+import asyncio
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from starlette.middleware.base import BaseHTTPMiddleware
+
+logger = logging.getLogger("courierflow.admission")
+
+# Route classes and their priority; low priority traffic is shed first
+PUBLIC_READ = "public_read"
+AUTHENTICATED = "authenticated"
+AUTH = "auth"
+
+LOW_PRIORITY = {PUBLIC_READ}
+
+# Probes must never be throttled or shed
+EXEMPT_PATHS = {"/api/health", "/api/live", "/api/ready"}
+
+
+class Quota:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate  # tokens refilled per second
+        self.burst = burst  # bucket capacity
+
+
+class InMemoryRateLimitBackend:
+    """Token buckets kept in this process. Each worker enforces its own limits.
+
+    Buckets are kept in least-recently-used order; past ``max_keys`` the
+    idlest ones are evicted, so a flood of new keys never resets the
+    buckets of clients that are still active.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, quota: Quota, cost: float = 1.0) -> Tuple[bool, float]:
+        return self.take_sync(key, quota, cost)
+
+    def take_sync(self, key: str, quota: Quota, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (quota.burst, now))
+            tokens = min(quota.burst, tokens + (now - updated) * quota.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        retry_after = 0.0 if allowed else (cost - tokens) / quota.rate
+        return allowed, retry_after
+
+
+class MongoRateLimitBackend:
+    """Token buckets stored in a Mongo collection so all workers share one limit.
+
+    Each take is a single atomic pipeline update, so concurrent workers never
+    double-spend a token.
+    """
+
+    def __init__(self, collection, ttl_seconds: int = 300):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def ensure_indexes(self):
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, quota: Quota, cost: float = 1.0) -> Tuple[bool, float]:
+        # Keep the round trip off the event loop
+        return await asyncio.to_thread(self.take_sync, key, quota, cost)
+
+    def take_sync(self, key: str, quota: Quota, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.time()
+        elapsed = {"$subtract": [now, {"$ifNull": ["$updated", now]}]}
+        refilled = {"$add": [{"$ifNull": ["$tokens", quota.burst]}, {"$multiply": [elapsed, quota.rate]}]}
+        bucket = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": {"$min": [quota.burst, refilled]}, "updated": now,
+                          "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (cost - bucket["tokens"]) / quota.rate
+
+
+class LoadShedder:
+    """Rejects traffic when the worker is overloaded.
+
+    Overload is judged from the requests running right now: once more than
+    ``min_in_flight`` of them have been running longer than
+    ``target_latency_ms``, low priority requests are rejected. One slow
+    request can't trip it on its own, and it recovers as soon as the slow
+    requests finish. Above ``max_in_flight`` every request is rejected.
+    """
+
+    def __init__(self, target_latency_ms: float = 500, max_in_flight: int = 200, min_in_flight: int = 4):
+        self.target_latency = target_latency_ms / 1000.0
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        # Start times in arrival order, so the oldest requests come first
+        self._running: "OrderedDict[int, float]" = OrderedDict()
+        self._tokens = itertools.count()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    def slow_in_flight(self) -> int:
+        now = time.monotonic()
+        slow = 0
+        for started in self._running.values():
+            if now - started <= self.target_latency:
+                break
+            slow += 1
+        return slow
+
+    def overloaded(self) -> bool:
+        return self.slow_in_flight() > self.min_in_flight
+
+    def should_shed(self, route_class: str) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return True
+        return route_class in LOW_PRIORITY and self.overloaded()
+
+    def started(self) -> int:
+        token = next(self._tokens)
+        self._running[token] = time.monotonic()
+        return token
+
+    def finished(self, token: int):
+        self._running.pop(token, None)
+
+    def retry_after(self) -> float:
+        return max(1.0, self.target_latency)
+
+
+def classify_route(method: str, path: str, user: Optional[str]) -> Optional[str]:
+    if path in EXEMPT_PATHS or method == "OPTIONS":
+        return None
+    if path in ("/api/auth/login", "/api/auth/register"):
+        return AUTH
+    if user is None:
+        return PUBLIC_READ
+    return AUTHENTICATED
+
+
+def client_ip(request) -> str:
+    # Never read X-Forwarded-For here: clients can set it. uvicorn's proxy_headers
+    # rewrites request.client only for connections from forwarded_allow_ips.
+    return request.client.host if request.client else "unknown"
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionMiddleware(BaseHTTPMiddleware):
+    """Per-client token-bucket rate limiting plus load shedding.
+
+    Anonymous requests are keyed by client IP and authenticated ones by user.
+    ``identify_user`` maps a request to a user key (or None) without hitting
+    the database.
+    """
+
+    def __init__(self, app, backend, quotas: Dict[str, Quota], shedder: LoadShedder,
+                 identify_user: Callable, enabled: bool = True):
+        super().__init__(app)
+        self.backend = backend
+        self.quotas = quotas
+        self.shedder = shedder
+        self.identify_user = identify_user
+        self.enabled = enabled
+
+    async def dispatch(self, request, call_next):
+        if not self.enabled:
+            return await call_next(request)
+        user = self.identify_user(request)
+        route_class = classify_route(request.method, request.url.path, user)
+        if route_class is None:
+            return await call_next(request)
+
+        if self.shedder.should_shed(route_class):
+            return _reject(503, "Service overloaded, please retry later", self.shedder.retry_after())
+
+        # Login and register always key by IP so credential stuffing can't rotate
+        # identities, each with its own bucket so sign-ups don't use up logins
+        if route_class == AUTH:
+            key = f"{route_class}:{request.url.path.rsplit('/', 1)[-1]}:ip:{client_ip(request)}"
+        elif user is None:
+            key = f"{route_class}:ip:{client_ip(request)}"
+        else:
+            key = f"{route_class}:user:{user}"
+        try:
+            allowed, retry_after = await self.backend.take(key, self.quotas[route_class])
+        except PyMongoError:
+            # Fail open: a rate-limit store outage must not take the API down with it
+            logger.exception("rate limit backend unavailable; admitting request")
+            allowed, retry_after = True, 0.0
+        if not allowed:
+            return _reject(429, "Too many requests", retry_after)
+
+        token = self.shedder.started()
+        try:
+            return await call_next(request)
+        finally:
+            self.shedder.finished(token)
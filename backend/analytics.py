@@ -0,0 +1,303 @@
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger("courierflow.analytics")
+
+HOUR = "hour"
+DAY = "day"
+GRANULARITIES = (HOUR, DAY)
+
+DELIVERED_STATUSES = {"delivered"}
+FAILED_STATUSES = {"failed_delivery", "returned", "cancelled"}
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _key(value: str) -> str:
+    # Field names can't contain '.' or start with '$'
+    return str(value).strip().lower().replace(".", "_").replace("$", "_") or "unknown"
+
+
+def lane_key(sender_city: str, receiver_city: str) -> str:
+    return f"{_key(sender_city)}->{_key(receiver_city)}"
+
+
+def status_transitions(events: Iterable[dict]) -> Iterator[Tuple[str, datetime]]:
+    """Yield ``(status, timestamp)`` for each update-status event that changed
+    its package's status, from tracking events sorted by tracking id and time.
+
+    Mirrors the live path, which counts an update only when it differs from
+    the package's previous status.
+    """
+    tracking_id = None
+    previous = None
+    for event in events:
+        if event["tracking_id"] != tracking_id:
+            tracking_id = event["tracking_id"]
+            previous = None
+        # Events without updated_by are the initial order_placed entries
+        if "updated_by" in event and previous is not None and event["status"] != previous:
+            yield event["status"], event["timestamp"]
+        previous = event["status"]
+
+
+class BackfillInProgress(RuntimeError):
+    pass
+
+
+class BackfillLockLost(RuntimeError):
+    pass
+
+
+class ShipmentRollups:
+    """Pre-aggregated shipment metrics in hourly and daily bucket documents.
+
+    Each bucket holds counters keyed by ``(granularity, bucket)``: packages
+    created, booked revenue (both also split by ``service_type``), lane
+    counts and status transitions. Buckets are bumped with ``$inc`` as
+    packages are created and updated, so range queries only read the
+    buckets in range and never touch ``packages``.
+
+    Each event carries an id (the package id, or the tracking event id). Its
+    marker in ``applied_collection`` is written in the same transaction as
+    its bucket updates, so a redelivered event is a no-op and an interrupted
+    one is either fully counted or not at all. Transactions need a replica
+    set (or sharded cluster).
+
+    A backfill records its cutoff in ``meta_collection``. Live events
+    before the cutoff are already in the rebuilt buckets and are skipped.
+    Live events that arrive while a backfill runs raise
+    ``BackfillInProgress`` so they can be applied after it finishes. The
+    backfill lock lasts ``backfill_lock_seconds`` and is renewed while the
+    rebuild runs, so a killed backfill only blocks live events briefly.
+    """
+
+    def __init__(self, collection, applied_collection, meta_collection,
+                 applied_ttl_seconds: int = 7 * 24 * 3600, backfill_lock_seconds: float = 60):
+        self.collection = collection
+        self.applied_collection = applied_collection
+        self.meta_collection = meta_collection
+        self.applied_ttl_seconds = applied_ttl_seconds
+        self.backfill_lock_seconds = backfill_lock_seconds
+
+    def ensure_indexes(self):
+        self.collection.create_index([("granularity", ASCENDING), ("bucket", ASCENDING)], unique=True)
+        self.applied_collection.create_index("applied_at", expireAfterSeconds=self.applied_ttl_seconds)
+
+    def record_package_created(self, package_id: str, created_at: datetime, service_type: str, price: float,
+                               sender_city: str, receiver_city: str):
+        service = _key(service_type or "unknown")
+        lane = lane_key(sender_city, receiver_city)
+        increments = {
+            "created": 1,
+            "revenue": price,
+            f"created_by_service.{service}": 1,
+            f"revenue_by_service.{service}": price,
+            f"lanes.{lane}": 1,
+        }
+        self._increment(f"created:{package_id}", created_at, increments)
+
+    def record_status_change(self, event_id: str, status: str, timestamp: datetime):
+        self._increment(f"status:{event_id}", timestamp, {f"status_changes.{_key(status)}": 1})
+
+    def backfill_running(self, state: Optional[dict] = None) -> bool:
+        if state is None:
+            state = self.meta_collection.find_one({"_id": "backfill"}) or {}
+        return bool(state.get("running_until") and state["running_until"] > datetime.utcnow())
+
+    def _increment(self, event_id: str, timestamp: datetime, increments: dict):
+        state = self.meta_collection.find_one({"_id": "backfill"}) or {}
+        if self.backfill_running(state):
+            raise BackfillInProgress("analytics backfill in progress")
+        if state.get("cutoff") and timestamp < state["cutoff"]:
+            return  # counted by the last backfill
+
+        def apply(session):
+            if self.applied_collection.find_one({"_id": event_id}, session=session):
+                return  # already counted
+            self.applied_collection.insert_one({"_id": event_id, "applied_at": datetime.utcnow()}, session=session)
+            for granularity in GRANULARITIES:
+                self.collection.update_one(
+                    {"granularity": granularity, "bucket": bucket_start(timestamp, granularity)},
+                    {"$inc": increments},
+                    upsert=True,
+                    session=session,
+                )
+
+        with self.collection.database.client.start_session() as session:
+            session.with_transaction(apply)
+
+    def backfill(self, packages_collection, tracking_collection) -> Optional[int]:
+        """Rebuild every bucket from packages and tracking history before now.
+
+        Buckets are built in a side collection and swapped in with a rename,
+        so readers never see a partial rebuild. Returns the number of buckets,
+        or None if another backfill holds the lock.
+        """
+        cutoff = datetime.utcnow()
+        owner = str(uuid.uuid4())
+        try:
+            self.meta_collection.find_one_and_update(
+                {"_id": "backfill", "$or": [{"running_until": None}, {"running_until": {"$lt": cutoff}}]},
+                {"$set": {"running_until": cutoff + timedelta(seconds=self.backfill_lock_seconds),
+                          "started_at": cutoff, "owner": owner}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return None
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._renew_lock_until, args=(owner, stop), daemon=True)
+        heartbeat.start()
+        try:
+            buckets = self._build_buckets(packages_collection, tracking_collection, cutoff)
+            staging = self.collection.database[f"{self.collection.name}_backfill"]
+            staging.drop()
+            staging.create_index([("granularity", ASCENDING), ("bucket", ASCENDING)], unique=True)
+            if buckets:
+                staging.insert_many(list(buckets.values()), ordered=False)
+            # Live events may already be running past an expired lock; don't swap over them
+            if not self._renew_lock(owner):
+                raise BackfillLockLost("analytics backfill lock expired before the swap")
+            staging.rename(self.collection.name, dropTarget=True)
+        except Exception:
+            stop.set()
+            self.meta_collection.update_one({"_id": "backfill", "owner": owner}, {"$set": {"running_until": None}})
+            raise
+        stop.set()
+        self.meta_collection.update_one(
+            {"_id": "backfill", "owner": owner}, {"$set": {"running_until": None, "cutoff": cutoff}}
+        )
+        return len(buckets)
+
+    def _renew_lock(self, owner: str) -> bool:
+        result = self.meta_collection.update_one(
+            {"_id": "backfill", "owner": owner},
+            {"$set": {"running_until": datetime.utcnow() + timedelta(seconds=self.backfill_lock_seconds)}},
+        )
+        return result.matched_count > 0
+
+    def _renew_lock_until(self, owner: str, stop: threading.Event):
+        while not stop.wait(self.backfill_lock_seconds / 3):
+            try:
+                if not self._renew_lock(owner):
+                    return
+            except Exception:
+                logger.exception("failed to renew the analytics backfill lock")
+
+    def _build_buckets(self, packages_collection, tracking_collection, cutoff: datetime) -> Dict[tuple, dict]:
+        buckets: Dict[tuple, dict] = {}
+
+        def bucket(granularity, timestamp):
+            key = (granularity, timestamp)
+            if key not in buckets:
+                buckets[key] = {
+                    "granularity": granularity, "bucket": timestamp, "created": 0, "revenue": 0,
+                    "created_by_service": {}, "revenue_by_service": {}, "lanes": {}, "status_changes": {},
+                }
+            return buckets[key]
+
+        for granularity in GRANULARITIES:
+            created = packages_collection.aggregate([
+                {"$match": {"created_at": {"$lt": cutoff}}},
+                {"$group": {
+                    "_id": {
+                        "bucket": self._truncate("$created_at", granularity),
+                        "service_type": "$service_type",
+                        "sender_city": {"$toLower": "$sender.city"},
+                        "receiver_city": {"$toLower": "$receiver.city"},
+                    },
+                    "count": {"$sum": 1},
+                    "revenue": {"$sum": "$price"},
+                }},
+            ], allowDiskUse=True)
+            for row in created:
+                group = row["_id"]
+                doc = bucket(granularity, group["bucket"])
+                service = _key(group.get("service_type") or "unknown")
+                lane = lane_key(group.get("sender_city") or "", group.get("receiver_city") or "")
+                doc["created"] += row["count"]
+                doc["revenue"] += row["revenue"]
+                doc["created_by_service"][service] = doc["created_by_service"].get(service, 0) + row["count"]
+                doc["revenue_by_service"][service] = doc["revenue_by_service"].get(service, 0) + row["revenue"]
+                doc["lanes"][lane] = doc["lanes"].get(lane, 0) + row["count"]
+
+        # Status transitions need each package's event order, so walk the history in index order
+        events = tracking_collection.find(
+            {"timestamp": {"$lt": cutoff}},
+            {"_id": 0, "tracking_id": 1, "status": 1, "timestamp": 1, "updated_by": 1},
+        ).sort([("tracking_id", ASCENDING), ("timestamp", ASCENDING)])
+        for status, timestamp in status_transitions(events):
+            for granularity in GRANULARITIES:
+                doc = bucket(granularity, bucket_start(timestamp, granularity))
+                status = _key(status)
+                doc["status_changes"][status] = doc["status_changes"].get(status, 0) + 1
+
+        return buckets
+
+    @staticmethod
+    def _truncate(field: str, granularity: str) -> dict:
+        parts = {"year": {"$year": field}, "month": {"$month": field}, "day": {"$dayOfMonth": field}}
+        if granularity == HOUR:
+            parts["hour"] = {"$hour": field}
+        return {"$dateFromParts": parts}
+
+    def query(self, start: datetime, end: datetime, granularity: str = DAY, top_lanes: int = 10) -> dict:
+        docs = self.collection.find(
+            {"granularity": granularity, "bucket": {"$gte": bucket_start(start, granularity), "$lt": end}},
+            {"_id": 0},
+        ).sort("bucket", ASCENDING)
+
+        series = []
+        totals = {"created": 0, "revenue": 0.0, "delivered": 0, "failed": 0}
+        revenue_by_service: Dict[str, float] = {}
+        created_by_service: Dict[str, int] = {}
+        lanes: Dict[str, int] = {}
+        for doc in docs:
+            status_changes = doc.get("status_changes", {})
+            delivered = sum(status_changes.get(s, 0) for s in DELIVERED_STATUSES)
+            failed = sum(status_changes.get(s, 0) for s in FAILED_STATUSES)
+            series.append({
+                "bucket": doc["bucket"].isoformat(),
+                "created": doc.get("created", 0),
+                "revenue": round(doc.get("revenue", 0), 2),
+                "delivered": delivered,
+                "failed": failed,
+            })
+            totals["created"] += doc.get("created", 0)
+            totals["revenue"] += doc.get("revenue", 0)
+            totals["delivered"] += delivered
+            totals["failed"] += failed
+            for service, value in doc.get("revenue_by_service", {}).items():
+                revenue_by_service[service] = revenue_by_service.get(service, 0) + value
+            for service, value in doc.get("created_by_service", {}).items():
+                created_by_service[service] = created_by_service.get(service, 0) + value
+            for lane, value in doc.get("lanes", {}).items():
+                lanes[lane] = lanes.get(lane, 0) + value
+
+        totals["revenue"] = round(totals["revenue"], 2)
+        outcomes = totals["delivered"] + totals["failed"]
+        success_rate: Optional[float] = round(totals["delivered"] / outcomes, 4) if outcomes else None
+        top = sorted(lanes.items(), key=lambda item: item[1], reverse=True)[:top_lanes]
+        return {
+            "granularity": granularity,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "totals": totals,
+            "delivery_success_rate": success_rate,
+            "created_by_service": created_by_service,
+            "revenue_by_service": {service: round(value, 2) for service, value in revenue_by_service.items()},
+            "top_lanes": [{"lane": lane, "packages": count} for lane, count in top],
+            "series": series,
+        }
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+logger = logging.getLogger("courierflow.jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+DEAD = "dead"
+
+
+class UnknownJob(KeyError):
+    pass
+
+
+class RetryLater(Exception):
+    """Raised by a handler that can't run yet; the job is requeued after
+    ``delay`` seconds without using up one of its attempts."""
+
+    def __init__(self, delay: float = 5.0, reason: str = ""):
+        super().__init__(reason)
+        self.delay = delay
+
+
+class JobQueue:
+    """Async job queue with a pool of worker tasks.
+
+    Durable jobs are stored in ``collection`` and claimed atomically, so any
+    number of processes can work the same queue and a job survives a
+    restart. A running job's lease is renewed by a heartbeat; a job whose
+    worker died is reclaimed once its lease expires, and the stale worker's
+    result is discarded because every update is fenced on the lease id.
+    Non-durable jobs live only in this process. Failed jobs are retried with
+    exponential backoff and, after ``max_attempts``, copied to
+    ``dead_letter_collection``. Jobs run at least once, so handlers should
+    tolerate being retried.
+    """
+
+    def __init__(self, collection, dead_letter_collection, workers: int = 2, max_attempts: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 300.0, poll_interval: float = 1.0,
+                 lease_seconds: float = 300.0, completed_ttl_seconds: int = 3600,
+                 max_memory_jobs: int = 10000):
+        self.collection = collection
+        self.dead_letter_collection = dead_letter_collection
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.completed_ttl_seconds = completed_ttl_seconds
+        self.max_memory_jobs = max_memory_jobs
+        self.handlers: Dict[str, Callable] = {}
+        self._memory_jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._memory_queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def register(self, name: str, handler: Callable):
+        self.handlers[name] = handler
+
+    def ensure_indexes(self):
+        self.collection.create_index("job_id", unique=True)
+        self.collection.create_index([("status", ASCENDING), ("run_at", ASCENDING)])
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._memory_queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout: float = 30.0):
+        """Stop claiming new jobs and wait up to ``timeout`` for running ones
+        to finish. Durable jobs still running after that are handed back to
+        the queue rather than left leased until their lease expires."""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending, timeout=1.0)
+        self._tasks = []
+
+    async def enqueue(self, name: str, payload: Optional[dict] = None, durable: bool = True, delay: float = 0) -> str:
+        if name not in self.handlers:
+            raise UnknownJob(name)
+        now = datetime.utcnow()
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "name": name,
+            "payload": payload or {},
+            "durable": durable,
+            "status": QUEUED,
+            "attempts": 0,
+            "run_at": now + timedelta(seconds=delay),
+            "created_at": now,
+            "updated_at": now,
+            "last_error": None,
+        }
+        if durable:
+            await asyncio.to_thread(self.collection.insert_one, job)
+            if self._wakeup is not None:
+                self._wakeup.set()
+        else:
+            self._remember(job)
+            self._schedule_memory(job, delay)
+        return job["job_id"]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self._memory_jobs.get(job_id)
+        if job is not None:
+            return {key: value for key, value in job.items() if key != "_id"}
+        return self.collection.find_one({"job_id": job_id}, {"_id": 0})
+
+    def stats(self) -> dict:
+        # One indexed count per status rather than a $group over the whole collection
+        durable = {status: self.collection.count_documents({"status": status})
+                   for status in (QUEUED, RUNNING, COMPLETED, DEAD)}
+        memory: Dict[str, int] = {}
+        for job in self._memory_jobs.values():
+            memory[job["status"]] = memory.get(job["status"], 0) + 1
+        return {
+            "durable": durable,
+            "memory": memory,
+            "dead_letter": self.dead_letter_collection.estimated_document_count(),
+            "workers": len(self._tasks),
+        }
+
+    def _remember(self, job: dict):
+        self._memory_jobs[job["job_id"]] = job
+        # Evict the oldest finished jobs to keep introspection memory bounded
+        while len(self._memory_jobs) > self.max_memory_jobs:
+            oldest_id = next(iter(self._memory_jobs))
+            if self._memory_jobs[oldest_id]["status"] in (QUEUED, RUNNING):
+                break
+            self._memory_jobs.popitem(last=False)
+
+    def _schedule_memory(self, job: dict, delay: float):
+        if self._memory_queue is None:
+            raise RuntimeError("job queue is not running")
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._memory_queue.put_nowait, job)
+        else:
+            self._memory_queue.put_nowait(job)
+        self._wakeup.set()
+
+    def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {"$or": [
+                {"status": QUEUED, "run_at": {"$lte": now}},
+                {"status": RUNNING, "locked_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": RUNNING, "locked_until": now + timedelta(seconds=self.lease_seconds),
+                      "lease_id": str(uuid.uuid4()), "updated_at": now},
+             "$inc": {"attempts": 1}},
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _next_job(self) -> Optional[dict]:
+        if not self._memory_queue.empty():
+            job = self._memory_queue.get_nowait()
+            job["status"] = RUNNING
+            job["attempts"] += 1
+            job["updated_at"] = datetime.utcnow()
+            return job
+        return await asyncio.to_thread(self._claim)
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                job = await self._next_job()
+            except Exception:
+                logger.exception("failed to claim job")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    def _owned(self, job: dict) -> dict:
+        # Updates only apply while this worker still holds the lease it claimed
+        return {"job_id": job["job_id"], "lease_id": job["lease_id"]}
+
+    async def _update_owned(self, job: dict, update: dict) -> bool:
+        result = await asyncio.to_thread(self.collection.update_one, self._owned(job), update)
+        if result.matched_count == 0:
+            logger.warning("job %s (%s) lost its lease; discarding this run's outcome", job["job_id"], job["name"])
+            return False
+        return True
+
+    async def _heartbeat(self, job: dict):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            renewed = await self._update_owned(job, {
+                "$set": {"locked_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}
+            })
+            if not renewed:
+                return
+
+    async def _run(self, job: dict):
+        handler = self.handlers.get(job["name"])
+        heartbeat = asyncio.create_task(self._heartbeat(job)) if job["durable"] else None
+        try:
+            if handler is None:
+                raise UnknownJob(job["name"])
+            if asyncio.iscoroutinefunction(handler):
+                await handler(**job["payload"])
+            else:
+                await asyncio.to_thread(handler, **job["payload"])
+        except RetryLater as exc:
+            await self._retry_later(job, exc.delay)
+        except asyncio.CancelledError:
+            if job["durable"]:
+                # Interrupted by shutdown, not failed: requeue without using up an attempt
+                await asyncio.shield(self._retry_later(job, 0))
+            raise
+        except Exception as exc:
+            logger.warning("job %s (%s) failed on attempt %s: %s", job["job_id"], job["name"], job["attempts"], exc)
+            await self._failed(job, "".join(traceback.format_exception(exc)))
+        else:
+            await self._completed(job)
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+
+    async def _retry_later(self, job: dict, delay: float):
+        run_at = datetime.utcnow() + timedelta(seconds=delay)
+        if not job["durable"]:
+            job.update({"status": QUEUED, "run_at": run_at, "attempts": job["attempts"] - 1})
+            self._schedule_memory(job, delay)
+            return
+        await self._update_owned(job, {
+            "$set": {"status": QUEUED, "run_at": run_at, "updated_at": datetime.utcnow()},
+            "$inc": {"attempts": -1},
+            "$unset": {"locked_until": "", "lease_id": ""},
+        })
+
+    async def _completed(self, job: dict):
+        now = datetime.utcnow()
+        if not job["durable"]:
+            job.update({"status": COMPLETED, "updated_at": now, "finished_at": now})
+            return
+        await self._update_owned(job, {
+            "$set": {"status": COMPLETED, "updated_at": now, "finished_at": now,
+                     "expires_at": now + timedelta(seconds=self.completed_ttl_seconds)},
+            "$unset": {"locked_until": ""},
+        })
+
+    async def _failed(self, job: dict, error: str):
+        now = datetime.utcnow()
+        if job["attempts"] >= self.max_attempts:
+            changes = {"status": DEAD, "updated_at": now, "finished_at": now, "last_error": error}
+            if job["durable"]:
+                owned = await self._update_owned(job, {
+                    "$set": dict(changes, expires_at=now + timedelta(seconds=self.completed_ttl_seconds)),
+                    "$unset": {"locked_until": ""},
+                })
+                if not owned:
+                    return
+            else:
+                job.update(changes)
+            dead = {key: value for key, value in job.items() if key != "_id"}
+            dead.update(changes)
+            await asyncio.to_thread(self.dead_letter_collection.insert_one, dead)
+            return
+
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (job["attempts"] - 1))
+        changes = {"status": QUEUED, "run_at": now + timedelta(seconds=delay), "updated_at": now, "last_error": error}
+        if job["durable"]:
+            await self._update_owned(job, {
+                "$set": changes,
+                "$unset": {"locked_until": "", "lease_id": ""},
+            })
+        else:
+            job.update(changes)
+            self._schedule_memory(job, delay)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Production launcher. Binds the listening socket once, then pre-forks one
+uvicorn worker per core that all accept on it:
+
+    python launcher.py --port 8001 --workers 4
+
+Each worker builds its own app (and Mongo connection pool) after the fork.
+SIGTERM/SIGINT drain: each worker first reports not-ready on /api/ready for
+--drain-delay seconds so load balancers stop routing to it, then stops
+accepting, finishes in-flight requests and runs its shutdown (tracking buffer
+flush, then the job queue) within --shutdown-timeout before exiting.
+Workers that die unexpectedly are replaced.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+logger = logging.getLogger("courierflow.launcher")
+
+
+def default_workers() -> int:
+    return int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class DrainingServer(uvicorn.Server):
+    """Marks the app not-ready on the first exit signal and keeps serving for
+    ``drain_delay`` seconds before uvicorn stops accepting connections."""
+
+    def __init__(self, config: uvicorn.Config, app, drain_delay: float):
+        super().__init__(config)
+        self.app = app
+        self.drain_delay = drain_delay
+        self.draining = False
+
+    def handle_exit(self, sig, frame):
+        if self.draining or self.drain_delay <= 0:
+            # A second signal skips the remaining delay
+            return super().handle_exit(sig, frame)
+        self.draining = True
+        self.app.state.ready = False
+        # uvicorn installs its handlers with loop.add_signal_handler, so we are on the loop here
+        asyncio.get_running_loop().call_later(self.drain_delay, super().handle_exit, sig, frame)
+
+
+def run_worker(sock: socket.socket, args):
+    # Undo the supervisor's handlers; uvicorn installs its own graceful ones
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    # Imported after the fork so every worker builds its own app and connection pool
+    from server import create_app
+
+    app = create_app()
+    # Half the shutdown budget for running jobs, the rest for the tracking flush and closing Mongo
+    app.state.job_shutdown_timeout = args.shutdown_timeout / 2
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_level=args.log_level,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+    )
+    server = DrainingServer(config, app, args.drain_delay)
+    server.run(sockets=[sock])
+    # Same exit code as uvicorn.run when lifespan startup (warm-up) fails
+    return 0 if server.started else 3
+
+
+class Supervisor:
+    def __init__(self, sock: socket.socket, args):
+        self.sock = sock
+        self.args = args
+        self.children = {}  # pid -> start time
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_worker(self.sock, self.args)
+            except BaseException:
+                logger.exception("worker crashed")
+            finally:
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        logger.info("started worker %s", pid)
+        if self.stopping:
+            # A shutdown signal arrived while this worker was being forked
+            self._signal(pid, signal.SIGTERM)
+
+    def stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info("draining %s workers", len(self.children))
+        for pid in self.children:
+            self._signal(pid, signal.SIGTERM)
+
+    def _signal(self, pid: int, sig: int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logger.warning("worker %s exited with status %s", pid, os.waitstatus_to_exitcode(status))
+            # Avoid a tight respawn loop when workers die during startup (e.g. Mongo is down)
+            if time.monotonic() - started < 5:
+                time.sleep(1)
+                if self.stopping:
+                    continue
+            self.spawn()
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.args.workers):
+            self.spawn()
+
+        while not self.stopping:
+            self.reap()
+            time.sleep(0.5)
+
+        # Give workers the drain delay, the graceful window and the lifespan shutdown budget
+        # (plus a moment to exit), then force
+        deadline = time.monotonic() + self.args.drain_delay + self.args.graceful_timeout + self.args.shutdown_timeout + 2
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            logger.warning("killing worker %s after drain timeout", pid)
+            self._signal(pid, signal.SIGKILL)
+        self.reap()
+        return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CourierFlow production launcher")
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8001')))
+    parser.add_argument("--workers", type=int, default=default_workers(), help="defaults to WEB_CONCURRENCY or CPU count")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="seconds to drain in-flight requests")
+    parser.add_argument("--shutdown-timeout", type=float, default=10,
+                        help="seconds for lifespan shutdown (tracking flush, running jobs) after requests drain")
+    parser.add_argument("--drain-delay", type=float, default=5, help="seconds to report not-ready before closing listeners")
+    parser.add_argument("--forwarded-allow-ips", default=os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+                        help="proxies trusted to set X-Forwarded-For (the client IP used for rate limits)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    sock = bind_socket(args.host, args.port, args.backlog)
+    logger.info("listening on %s:%s with %s workers", args.host, args.port, args.workers)
+    return Supervisor(sock, args).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,42 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from pymongo import MongoClient
-from datetime import datetime, timedelta
+from pymongo import MongoClient, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import os
 import bcrypt
 import jwt
+import json
 import uuid
+import logging
 from typing import List, Optional
 import random
 import math
+import asyncio
 
-# Initialize FastAPI app
-app = FastAPI()
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from write_buffer import GroupCommitBuffer
+from analytics import ShipmentRollups, GRANULARITIES, DAY
+from jobs import JobQueue
+from tasks import register_tasks, package_created_payload
+from admission import (
+    AdmissionMiddleware, InMemoryRateLimitBackend, LoadShedder, MongoRateLimitBackend, Quota,
+    PUBLIC_READ, AUTHENTICATED, AUTH,
 )
 
+logger = logging.getLogger("courierflow.server")
+
+# Routes are registered on a router and mounted by create_app()
+router = APIRouter()
+
 # MongoDB connection
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 DB_NAME = os.environ.get('DB_NAME', 'courier_db')
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
 
 # JWT configuration
 SECRET_KEY = "courier_delivery_secret_key_2025"
@@ -38,10 +46,185 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 # Security
 security = HTTPBearer()
 
-# Database collections
-users_collection = db.users
-packages_collection = db.packages
-tracking_collection = db.tracking
+# Background jobs; set JOB_WORKERS=0 when jobs run in separate worker.py processes
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# How long shutdown waits for running jobs; unfinished durable jobs are handed back to the queue
+JOB_SHUTDOWN_TIMEOUT = float(os.environ.get('JOB_SHUTDOWN_TIMEOUT', '5'))
+
+# Tracking write buffer (group commit of tracking events, off by default)
+TRACKING_WRITE_BUFFER = os.environ.get('TRACKING_WRITE_BUFFER', 'false').lower() == 'true'
+
+# Admission control: per-client rate limits and load shedding (off by default).
+# Anonymous and login/register limits are keyed by client IP, so behind a proxy only
+# enable this once uvicorn trusts it (FORWARDED_ALLOW_IPS, or launcher.py
+# --forwarded-allow-ips); otherwise every client shares the proxy's buckets.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'false').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory, mongo
+RATE_LIMIT_QUOTAS = {
+    PUBLIC_READ: Quota(rate=float(os.environ.get('RATE_LIMIT_PUBLIC_RATE', '5')),
+                       burst=float(os.environ.get('RATE_LIMIT_PUBLIC_BURST', '20'))),
+    AUTHENTICATED: Quota(rate=float(os.environ.get('RATE_LIMIT_USER_RATE', '20')),
+                         burst=float(os.environ.get('RATE_LIMIT_USER_BURST', '50'))),
+    AUTH: Quota(rate=float(os.environ.get('RATE_LIMIT_AUTH_RATE', '0.2')),
+                burst=float(os.environ.get('RATE_LIMIT_AUTH_BURST', '5'))),
+}
+
+# Optional JSON file of {"city": [lat, lon]} merged over the built-in gazetteer
+GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH')
+
+# Probes use their own client with short timeouts so a Mongo outage can't pin executor threads
+PROBE_TIMEOUT_MS = int(os.environ.get('PROBE_TIMEOUT_MS', '2000'))
+
+class Services:
+    """Mongo client and everything bound to its collections, one per app.
+
+    The clients connect lazily (connect=False), so building this does no I/O
+    and is safe in a freshly forked worker.
+    """
+
+    def __init__(self):
+        self.client = MongoClient(MONGO_URL, connect=False, maxPoolSize=MONGO_MAX_POOL_SIZE)
+        self.probe_client = MongoClient(
+            MONGO_URL,
+            connect=False,
+            maxPoolSize=1,
+            serverSelectionTimeoutMS=PROBE_TIMEOUT_MS,
+            connectTimeoutMS=PROBE_TIMEOUT_MS,
+            socketTimeoutMS=PROBE_TIMEOUT_MS,
+        )
+        self.db = self.client[DB_NAME]
+
+        # Database collections
+        self.users_collection = self.db.users
+        self.packages_collection = self.db.packages
+        self.tracking_collection = self.db.tracking
+        self.analytics_rollups = ShipmentRollups(
+            self.db.analytics_rollups, self.db.analytics_applied, self.db.analytics_meta
+        )
+
+        self.job_queue = JobQueue(
+            self.db.jobs,
+            self.db.dead_letter_jobs,
+            workers=JOB_WORKERS,
+            max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', '5')),
+        )
+        register_tasks(self.job_queue, self.packages_collection, self.tracking_collection, self.analytics_rollups)
+
+        self.tracking_buffer = GroupCommitBuffer(
+            self.tracking_collection,
+            max_batch=int(os.environ.get('TRACKING_BUFFER_MAX_BATCH', '500')),
+            max_delay_ms=float(os.environ.get('TRACKING_BUFFER_MAX_DELAY_MS', '5')),
+            max_pending=int(os.environ.get('TRACKING_BUFFER_MAX_PENDING', '10000')),
+        )
+
+        if RATE_LIMIT_BACKEND == 'mongo':
+            self.rate_limit_backend = MongoRateLimitBackend(self.db.rate_limits)
+        else:
+            self.rate_limit_backend = InMemoryRateLimitBackend()
+
+    def ensure_indexes(self):
+        self.users_collection.create_index("email")
+        self.packages_collection.create_index("tracking_id")
+        self.packages_collection.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+        self.packages_collection.create_index([("created_at", DESCENDING)])
+        self.tracking_collection.create_index([("tracking_id", ASCENDING), ("timestamp", ASCENDING)])
+        self.analytics_rollups.ensure_indexes()
+        self.job_queue.ensure_indexes()
+        if RATE_LIMIT_BACKEND == 'mongo':
+            self.rate_limit_backend.ensure_indexes()
+
+    def warm_up(self):
+        # Fail fast if Mongo is unreachable, then open a pooled connection and prepare caches
+        self.client.admin.command("ping")
+        self.ensure_indexes()
+        load_gazetteer()
+        prime_distance_cache()
+
+    def ping(self):
+        self.probe_client.admin.command("ping")
+
+    def close(self):
+        self.client.close()
+        self.probe_client.close()
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+def identify_user(request) -> Optional[str]:
+    # Decode the bearer token without a database lookup; invalid tokens count as anonymous
+    authorization = request.headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return payload.get("sub")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    services = app.state.services
+    await asyncio.to_thread(services.warm_up)
+    if TRACKING_WRITE_BUFFER:
+        services.tracking_buffer.start()
+    if JOB_WORKERS > 0:
+        services.job_queue.start()
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        # launcher.py flips readiness on SIGTERM before uvicorn stops accepting;
+        # by the time this runs, connections have already drained
+        app.state.ready = False
+        # Flush queued tracking events first: they are acknowledged writes, while jobs can be retried
+        await services.tracking_buffer.close()
+        await services.job_queue.close(timeout=app.state.job_shutdown_timeout)
+        services.close()
+
+def create_app() -> FastAPI:
+    services = Services()
+
+    # Initialize FastAPI app
+    app = FastAPI(lifespan=lifespan)
+    app.state.services = services
+    app.state.ready = False
+    app.state.job_shutdown_timeout = JOB_SHUTDOWN_TIMEOUT
+
+    load_shedder = LoadShedder(
+        target_latency_ms=float(os.environ.get('LOAD_SHED_TARGET_LATENCY_MS', '500')),
+        max_in_flight=int(os.environ.get('LOAD_SHED_MAX_IN_FLIGHT', '200')),
+    )
+    app.add_middleware(
+        AdmissionMiddleware,
+        backend=services.rate_limit_backend,
+        quotas=RATE_LIMIT_QUOTAS,
+        shedder=load_shedder,
+        identify_user=identify_user,
+        enabled=RATE_LIMIT_ENABLED,
+    )
+
+    # Add CORS middleware (outermost, so 429/503 rejections still carry CORS headers)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.include_router(router)
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # Keeps `uvicorn server:app` working: the app is only built on first access
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Pydantic models
 class UserCreate(BaseModel):
@@ -98,36 +281,55 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    services: Services = Depends(get_services)
+):
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = users_collection.find_one({"email": email})
+        user = services.users_collection.find_one({"email": email})
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
         return user
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# Mock gazetteer for distance calculation - in real app, use Google Maps API
+DEFAULT_CITY_COORDINATES = {
+    "mumbai": (19.0760, 72.8777),
+    "delhi": (28.7041, 77.1025),
+    "bangalore": (12.9716, 77.5946),
+    "chennai": (13.0827, 80.2707),
+    "kolkata": (22.5726, 88.3639),
+    "hyderabad": (17.3850, 78.4867),
+    "pune": (18.5204, 73.8567),
+    "ahmedabad": (23.0225, 72.5714)
+}
+city_coordinates = dict(DEFAULT_CITY_COORDINATES)
+
+def load_gazetteer():
+    global city_coordinates
+    coordinates = dict(DEFAULT_CITY_COORDINATES)
+    if GAZETTEER_PATH:
+        with open(GAZETTEER_PATH) as f:
+            coordinates.update({city.lower(): tuple(coords) for city, coords in json.load(f).items()})
+    city_coordinates = coordinates
+    city_distance.cache_clear()
+
+def prime_distance_cache():
+    for sender_lower in city_coordinates:
+        for receiver_lower in city_coordinates:
+            city_distance(sender_lower, receiver_lower)
+
 def calculate_distance(sender_city: str, receiver_city: str) -> float:
-    # Mock distance calculation - in real app, use Google Maps API
-    city_coordinates = {
-        "mumbai": (19.0760, 72.8777),
-        "delhi": (28.7041, 77.1025),
-        "bangalore": (12.9716, 77.5946),
-        "chennai": (13.0827, 80.2707),
-        "kolkata": (22.5726, 88.3639),
-        "hyderabad": (17.3850, 78.4867),
-        "pune": (18.5204, 73.8567),
-        "ahmedabad": (23.0225, 72.5714)
-    }
-    
-    sender_lower = sender_city.lower()
-    receiver_lower = receiver_city.lower()
-    
+    return city_distance(sender_city.lower(), receiver_city.lower())
+
+@lru_cache(maxsize=4096)
+def city_distance(sender_lower: str, receiver_lower: str) -> float:
     # Default coordinates if city not found
     sender_coords = city_coordinates.get(sender_lower, (20.0, 77.0))
     receiver_coords = city_coordinates.get(receiver_lower, (21.0, 78.0))
@@ -160,17 +362,52 @@ def calculate_price(weight: float, distance: float, service_type: str) -> float:
     price = (base_price + (weight * weight_rate) + (distance * distance_rate)) * service_multiplier.get(service_type, 1.0)
     return round(price, 2)
 
+def parse_utc(value: str) -> datetime:
+    # Stored timestamps are naive UTC; normalise aware inputs (e.g. "...Z" or "+05:30") to match
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+async def insert_tracking_event(services: Services, tracking_doc: dict):
+    if TRACKING_WRITE_BUFFER:
+        await services.tracking_buffer.insert(tracking_doc)
+    else:
+        services.tracking_collection.insert_one(tracking_doc)
+
+async def enqueue_follow_up(services: Services, name: str, payload: dict):
+    # The write already committed; failing the request now would only make clients retry it
+    try:
+        await services.job_queue.enqueue(name, payload)
+    except Exception:
+        logger.exception("failed to enqueue %s job", name)
+
 # API Routes
 
-@app.get("/api/health")
+@router.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "courier-delivery-api"}
 
+@router.get("/api/live")
+async def liveness_check():
+    # Only proves the event loop is serving; a Mongo outage should not restart workers
+    return {"status": "alive"}
+
+@router.get("/api/ready")
+async def readiness_check(request: Request, services: Services = Depends(get_services)):
+    if not request.app.state.ready:
+        return JSONResponse({"status": "not_ready", "reason": "starting or draining"}, status_code=503)
+    try:
+        await asyncio.to_thread(services.ping)
+    except PyMongoError:
+        return JSONResponse({"status": "not_ready", "reason": "database unavailable"}, status_code=503)
+    return {"status": "ready"}
+
 # Authentication endpoints
-@app.post("/api/auth/register")
-async def register(user: UserCreate):
+@router.post("/api/auth/register")
+async def register(user: UserCreate, services: Services = Depends(get_services)):
     # Check if user already exists
-    existing_user = users_collection.find_one({"email": user.email})
+    existing_user = services.users_collection.find_one({"email": user.email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -188,7 +425,7 @@ async def register(user: UserCreate):
         "is_active": True
     }
     
-    result = users_collection.insert_one(user_doc)
+    result = services.users_collection.insert_one(user_doc)
     if result.inserted_id:
         # Create access token
         access_token = create_access_token(data={"sub": user.email})
@@ -206,10 +443,10 @@ async def register(user: UserCreate):
     else:
         raise HTTPException(status_code=500, detail="Failed to create user")
 
-@app.post("/api/auth/login")
-async def login(user_credentials: UserLogin):
+@router.post("/api/auth/login")
+async def login(user_credentials: UserLogin, services: Services = Depends(get_services)):
     # Find user
-    user = users_collection.find_one({"email": user_credentials.email})
+    user = services.users_collection.find_one({"email": user_credentials.email})
     if not user or not verify_password(user_credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
@@ -226,7 +463,7 @@ async def login(user_credentials: UserLogin):
         }
     }
 
-@app.get("/api/auth/me")
+@router.get("/api/auth/me")
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     return {
         "user_id": current_user["user_id"],
@@ -236,7 +473,7 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     }
 
 # Package endpoints
-@app.post("/api/packages/calculate-price")
+@router.post("/api/packages/calculate-price")
 async def calculate_package_price(data: dict, current_user: dict = Depends(get_current_user)):
     sender_city = data.get("sender_city")
     receiver_city = data.get("receiver_city")
@@ -253,8 +490,8 @@ async def calculate_package_price(data: dict, current_user: dict = Depends(get_c
         "weight_kg": weight
     }
 
-@app.post("/api/packages/create")
-async def create_package(package_data: PackageCreate, current_user: dict = Depends(get_current_user)):
+@router.post("/api/packages/create")
+async def create_package(package_data: PackageCreate, current_user: dict = Depends(get_current_user), services: Services = Depends(get_services)):
     # Generate tracking ID
     tracking_id = f"CD{random.randint(100000, 999999)}"
     
@@ -279,7 +516,7 @@ async def create_package(package_data: PackageCreate, current_user: dict = Depen
         "estimated_delivery": datetime.utcnow() + timedelta(days=3 if package_data.service_type == "standard" else 1)
     }
     
-    result = packages_collection.insert_one(package_doc)
+    result = services.packages_collection.insert_one(package_doc)
     
     if result.inserted_id:
         # Create initial tracking entry
@@ -291,7 +528,8 @@ async def create_package(package_data: PackageCreate, current_user: dict = Depen
             "timestamp": datetime.utcnow(),
             "notes": "Order has been placed successfully"
         }
-        tracking_collection.insert_one(tracking_doc)
+        await insert_tracking_event(services, tracking_doc)
+        await enqueue_follow_up(services, "record_package_created", package_created_payload(package_doc))
         
         return {
             "message": "Package created successfully",
@@ -303,24 +541,24 @@ async def create_package(package_data: PackageCreate, current_user: dict = Depen
     else:
         raise HTTPException(status_code=500, detail="Failed to create package")
 
-@app.get("/api/packages/my-packages")
-async def get_user_packages(current_user: dict = Depends(get_current_user)):
-    packages = list(packages_collection.find(
+@router.get("/api/packages/my-packages")
+async def get_user_packages(current_user: dict = Depends(get_current_user), services: Services = Depends(get_services)):
+    packages = list(services.packages_collection.find(
         {"user_id": current_user["user_id"]},
         {"_id": 0}
     ).sort("created_at", -1))
     
     return {"packages": packages}
 
-@app.get("/api/packages/track/{tracking_id}")
-async def track_package(tracking_id: str):
+@router.get("/api/packages/track/{tracking_id}")
+async def track_package(tracking_id: str, services: Services = Depends(get_services)):
     # Get package details
-    package = packages_collection.find_one({"tracking_id": tracking_id}, {"_id": 0})
+    package = services.packages_collection.find_one({"tracking_id": tracking_id}, {"_id": 0})
     if not package:
         raise HTTPException(status_code=404, detail="Package not found")
     
     # Get tracking history
-    tracking_history = list(tracking_collection.find(
+    tracking_history = list(services.tracking_collection.find(
         {"tracking_id": tracking_id},
         {"_id": 0}
     ).sort("timestamp", 1))
@@ -331,47 +569,57 @@ async def track_package(tracking_id: str):
     }
 
 # Admin endpoints
-@app.get("/api/admin/packages")
-async def get_all_packages(current_user: dict = Depends(get_current_user)):
+@router.get("/api/admin/packages")
+async def get_all_packages(current_user: dict = Depends(get_current_user), services: Services = Depends(get_services)):
     if current_user.get("role") not in ["admin", "delivery_agent"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    packages = list(packages_collection.find({}, {"_id": 0}).sort("created_at", -1))
+    packages = list(services.packages_collection.find({}, {"_id": 0}).sort("created_at", -1))
     return {"packages": packages}
 
-@app.post("/api/admin/update-status")
-async def update_package_status(update_data: TrackingUpdate, current_user: dict = Depends(get_current_user)):
+@router.post("/api/admin/update-status")
+async def update_package_status(update_data: TrackingUpdate, current_user: dict = Depends(get_current_user), services: Services = Depends(get_services)):
     if current_user.get("role") not in ["admin", "delivery_agent"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Update package status
-    packages_collection.update_one(
+    # Update package status, keeping the previous one for analytics
+    previous = services.packages_collection.find_one_and_update(
         {"tracking_id": update_data.tracking_id},
-        {"$set": {"status": update_data.status}}
+        {"$set": {"status": update_data.status}},
+        projection={"status": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    timestamp = datetime.utcnow()
     
     # Add tracking entry
     tracking_doc = {
         "tracking_id": update_data.tracking_id,
         "status": update_data.status,
         "location": update_data.location,
-        "timestamp": datetime.utcnow(),
+        "timestamp": timestamp,
         "notes": update_data.notes,
         "updated_by": current_user["user_id"]
     }
-    tracking_collection.insert_one(tracking_doc)
+    await insert_tracking_event(services, tracking_doc)
+    
+    if previous and previous.get("status") != update_data.status:
+        await enqueue_follow_up(services, "record_status_change", {
+            "event_id": str(tracking_doc["_id"]),
+            "status": update_data.status,
+            "timestamp": timestamp
+        })
     
     return {"message": "Status updated successfully"}
 
-@app.get("/api/admin/stats")
-async def get_admin_stats(current_user: dict = Depends(get_current_user)):
+@router.get("/api/admin/stats")
+async def get_admin_stats(current_user: dict = Depends(get_current_user), services: Services = Depends(get_services)):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Access denied")
     
-    total_packages = packages_collection.count_documents({})
-    delivered_packages = packages_collection.count_documents({"status": "delivered"})
-    pending_packages = packages_collection.count_documents({"status": {"$ne": "delivered"}})
-    total_users = users_collection.count_documents({"role": "customer"})
+    total_packages = services.packages_collection.count_documents({})
+    delivered_packages = services.packages_collection.count_documents({"status": "delivered"})
+    pending_packages = services.packages_collection.count_documents({"status": {"$ne": "delivered"}})
+    total_users = services.users_collection.count_documents({"role": "customer"})
     
     return {
         "total_packages": total_packages,
@@ -380,6 +628,58 @@ async def get_admin_stats(current_user: dict = Depends(get_current_user)):
         "total_users": total_users
     }
 
+@router.get("/api/admin/analytics")
+async def get_admin_analytics(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    granularity: str = DAY,
+    current_user: dict = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be 'hour' or 'day'")
+    
+    try:
+        end_time = parse_utc(end) if end else datetime.utcnow()
+        start_time = parse_utc(start) if start else end_time - timedelta(days=30)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO 8601 dates")
+    if start_time >= end_time:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    return services.analytics_rollups.query(start_time, end_time, granularity)
+
+@router.post("/api/admin/analytics/backfill", status_code=202)
+async def backfill_admin_analytics(current_user: dict = Depends(get_current_user), services: Services = Depends(get_services)):
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    if await asyncio.to_thread(services.analytics_rollups.backfill_running):
+        raise HTTPException(status_code=409, detail="An analytics backfill is already running")
+    # Rebuild as a durable job so a restart mid-rebuild retries it; poll /api/admin/jobs/{job_id}
+    job_id = await services.job_queue.enqueue("backfill_analytics")
+    return {"message": "Analytics backfill queued", "job_id": job_id}
+
+@router.get("/api/admin/jobs")
+async def get_job_stats(current_user: dict = Depends(get_current_user), services: Services = Depends(get_services)):
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return await asyncio.to_thread(services.job_queue.stats)
+
+@router.get("/api/admin/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user), services: Services = Depends(get_services)):
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    job = await asyncio.to_thread(services.job_queue.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 if __name__ == "__main__":
+    # Single-process development server; use launcher.py for production
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run("server:create_app", factory=True, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import logging
+
+from analytics import BackfillInProgress
+from jobs import RetryLater
+
+logger = logging.getLogger("courierflow.tasks")
+
+# How long analytics jobs wait before checking again whether a backfill has finished
+BACKFILL_RETRY_SECONDS = 10
+
+
+def package_created_payload(package_doc: dict) -> dict:
+    """Everything the rollup needs, so the job never reads the package back."""
+    return {
+        "package_id": package_doc["package_id"],
+        "created_at": package_doc["created_at"],
+        "service_type": package_doc.get("service_type", "unknown"),
+        "price": package_doc.get("price", 0),
+        "sender_city": package_doc["sender"]["city"],
+        "receiver_city": package_doc["receiver"]["city"],
+    }
+
+
+def register_tasks(queue, packages_collection, tracking_collection, analytics_rollups):
+    """Register the follow-up jobs enqueued by request handlers."""
+
+    def record_package_created(package_id: str, **fields):
+        if not fields:
+            # Queued before the payload carried the package fields
+            package = packages_collection.find_one({"package_id": package_id})
+            if not package:
+                return
+            fields = package_created_payload(package)
+            del fields["package_id"]
+        try:
+            analytics_rollups.record_package_created(package_id, **fields)
+        except BackfillInProgress as exc:
+            raise RetryLater(BACKFILL_RETRY_SECONDS, str(exc))
+
+    def record_status_change(event_id: str, status: str, timestamp):
+        try:
+            analytics_rollups.record_status_change(event_id, status, timestamp)
+        except BackfillInProgress as exc:
+            raise RetryLater(BACKFILL_RETRY_SECONDS, str(exc))
+
+    def backfill_analytics():
+        buckets = analytics_rollups.backfill(packages_collection, tracking_collection)
+        if buckets is None:
+            logger.info("skipping analytics backfill: another one is running")
+        else:
+            logger.info("analytics backfill rebuilt %s buckets", buckets)
+
+    queue.register("record_package_created", record_package_created)
+    queue.register("record_status_change", record_status_change)
+    queue.register("backfill_analytics", backfill_analytics)
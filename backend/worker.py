@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Standalone job worker. Runs the background job queue without serving HTTP,
+so heavy jobs can be scaled separately from the API:
+
+    JOB_WORKERS=0 python launcher.py       # API only enqueues
+    python worker.py --workers 8           # one or more worker processes
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+
+import server
+
+
+async def run(workers: int):
+    services = server.Services()
+    job_queue = services.job_queue
+    job_queue.workers = workers
+    await asyncio.to_thread(job_queue.ensure_indexes)
+    job_queue.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    # Let running jobs finish; unfinished durable jobs are reclaimed after their lease
+    await job_queue.close()
+    services.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CourierFlow background job worker")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent jobs in this process")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args.workers))
@@ -0,0 +1,125 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+
+class WriteBufferClosed(RuntimeError):
+    pass
+
+
+class GroupCommitBuffer:
+    """Coalesces single-document inserts from concurrent requests into
+    ``insert_many`` batches.
+
+    A batch is flushed once it holds ``max_batch`` documents or once the
+    oldest queued document has waited ``max_delay_ms``. Each caller awaits
+    the acknowledgement of its own document, so a request only returns once
+    its write is as durable as an ``insert_one`` would have made it.
+    ``max_pending`` bounds the number of queued plus in-flight documents;
+    callers wait for room when Mongo falls behind.
+    """
+
+    def __init__(self, collection, max_batch: int = 500, max_delay_ms: float = 5.0, max_pending: int = 10000):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def start(self):
+        if self._flusher is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._closed = False
+        self._flusher = asyncio.create_task(self._run())
+
+    async def insert(self, doc: dict):
+        if self._closed or self._flusher is None:
+            raise WriteBufferClosed("write buffer is not running")
+        # Backpressure: wait for a free slot instead of growing without bound
+        await self._slots.acquire()
+        if self._closed:
+            self._slots.release()
+            raise WriteBufferClosed("write buffer is shutting down")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put_nowait((doc, future, loop.time()))
+        return await future
+
+    async def close(self):
+        if self._flusher is None:
+            return
+        self._closed = True
+        # Sentinel tells the flusher to drain whatever is queued and exit
+        self._queue.put_nowait(None)
+        await self._flusher
+        self._flusher = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            stopping = False
+            # Measured from when the oldest document was queued, not from when it was dequeued
+            deadline = first[2] + self.max_delay
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    item = self._queue.get_nowait()
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                # Drain anything that raced in ahead of the sentinel
+                rest = []
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None:
+                        rest.append(item)
+                for i in range(0, len(rest), self.max_batch):
+                    await self._flush(rest[i:i + self.max_batch])
+                return
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future, float]]):
+        docs = [doc for doc, _, _ in batch]
+        failed = {}
+        error: Optional[BaseException] = None
+        try:
+            await asyncio.to_thread(self.collection.insert_many, docs, ordered=False)
+        except BulkWriteError as exc:
+            if exc.details.get("writeConcernErrors"):
+                # The write concern wasn't met, so no document in the batch is known to be durable
+                error = exc
+            else:
+                # Unordered inserts report per-document errors; the rest succeeded
+                for write_error in exc.details.get("writeErrors", []):
+                    failed[write_error["index"]] = BulkWriteError({"writeErrors": [write_error]})
+        except Exception as exc:
+            error = exc
+        for index, (doc, future, _) in enumerate(batch):
+            self._slots.release()
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            elif index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(doc.get("_id"))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend is run from its own directory (`uvicorn server:app`), so import it the same way
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
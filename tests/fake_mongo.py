@@ -0,0 +1,226 @@
+import copy
+import itertools
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def _set(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset(doc, path):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+            continue
+        value, present = _get(doc, key)
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$exists" and present != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$lt" and not (present and value < operand):
+                    return False
+                if op == "$lte" and not (present and value <= operand):
+                    return False
+                if op == "$gte" and not (present and value >= operand):
+                    return False
+        elif condition is None:
+            if value is not None:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class UpdateResult:
+    def __init__(self, matched_count, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = matched_count
+        self.upserted_id = upserted_id
+
+
+class InsertResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class FakeSession:
+    """Transactions roll back every collection in the database when the
+    callback raises; no isolation between concurrent sessions."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def with_transaction(self, callback):
+        snapshot = {name: copy.deepcopy(collection.docs) for name, collection in self.database.collections.items()}
+        try:
+            return callback(self)
+        except Exception:
+            for name, docs in snapshot.items():
+                self.database.collections[name].docs = docs
+            raise
+
+
+class FakeClient:
+    def __init__(self, database):
+        self.database = database
+
+    def start_session(self):
+        return FakeSession(self.database)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+        self.client = FakeClient(self)
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            FakeCollection(name, self)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class FakeCollection:
+    """Just enough of a pymongo collection for unit tests: equality and
+    comparison filters, $or/$exists/$ne, and $set/$inc/$unset updates.
+    ``session`` arguments are accepted and ignored; see FakeSession."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name="fake", database=None):
+        self.name = name
+        self.docs = []
+        self.database = database or FakeDatabase()
+        self.database.collections[name] = self
+
+    def _check_unique(self, doc):
+        if any(existing["_id"] == doc["_id"] for existing in self.docs):
+            raise DuplicateKeyError(f"duplicate _id {doc['_id']!r}")
+
+    def insert_one(self, doc, session=None):
+        doc.setdefault("_id", next(self._ids))
+        self._check_unique(doc)
+        self.docs.append(copy.deepcopy(doc))
+        return InsertResult(doc["_id"])
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.insert_one(doc)
+
+    def find_one(self, query=None, projection=None, session=None):
+        for doc in self.docs:
+            if matches(doc, query or {}):
+                return self._project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([self._project(doc, projection) for doc in self.docs if matches(doc, query or {})])
+
+    def count_documents(self, query):
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def delete_one(self, query):
+        for doc in self.docs:
+            if matches(doc, query):
+                self.docs.remove(doc)
+                return
+
+    def delete_many(self, query):
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+
+    def create_index(self, *args, **kwargs):
+        return None
+
+    def drop(self):
+        self.docs = []
+
+    def rename(self, new_name, dropTarget=False):
+        self.database.collections.pop(self.name, None)
+        self.name = new_name
+        self.database.collections[new_name] = self
+
+    def _project(self, doc, projection):
+        doc = copy.deepcopy(doc)
+        if projection and projection.get("_id") == 0:
+            doc.pop("_id", None)
+        return doc
+
+    def _apply(self, doc, update):
+        for path, value in update.get("$set", {}).items():
+            _set(doc, path, value)
+        for path, value in update.get("$inc", {}).items():
+            current, _ = _get(doc, path)
+            _set(doc, path, (current or 0) + value)
+        for path in update.get("$unset", {}):
+            _unset(doc, path)
+
+    def update_one(self, query, update, upsert=False, session=None):
+        for doc in self.docs:
+            if matches(doc, query):
+                self._apply(doc, update)
+                return UpdateResult(1)
+        if not upsert:
+            return UpdateResult(0)
+        doc = {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+        doc["_id"] = next(self._ids)
+        self._apply(doc, update)
+        self.docs.append(doc)
+        return UpdateResult(0, doc["_id"])
+
+    def find_one_and_update(self, query, update, sort=None, return_document=ReturnDocument.BEFORE, **kwargs):
+        candidates = [doc for doc in self.docs if matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            candidates.sort(key=lambda doc: _get(doc, key)[0], reverse=direction < 0)
+        if not candidates:
+            if not kwargs.get("upsert"):
+                return None
+            doc = {key: value for key, value in query.items() if not key.startswith("$")}
+            self.insert_one(doc)
+            doc = self.docs[-1]
+            self._apply(doc, update)
+            return copy.deepcopy(doc) if return_document == ReturnDocument.AFTER else None
+        doc = candidates[0]
+        before = copy.deepcopy(doc)
+        self._apply(doc, update)
+        return copy.deepcopy(doc) if return_document == ReturnDocument.AFTER else before
+
+
+class FakeCursor(list):
+    def sort(self, key, direction=1):
+        return FakeCursor(sorted(self, key=lambda doc: _get(doc, key)[0], reverse=direction < 0))
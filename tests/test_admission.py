@@ -0,0 +1,175 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+import admission
+from admission import (
+    AUTH, AUTHENTICATED, PUBLIC_READ, AdmissionMiddleware, InMemoryRateLimitBackend, LoadShedder, Quota,
+    classify_route,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def take(backend, key, quota):
+    return asyncio.run(backend.take(key, quota))
+
+
+def test_bucket_allows_burst_then_reports_retry_after(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock.monotonic)
+    backend = InMemoryRateLimitBackend()
+    quota = Quota(rate=2, burst=3)
+
+    assert [take(backend, "k", quota)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = take(backend, "k", quota)
+    assert not allowed
+    assert retry_after == 0.5
+
+
+def test_bucket_refills_over_time(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock.monotonic)
+    backend = InMemoryRateLimitBackend()
+    quota = Quota(rate=1, burst=2)
+    take(backend, "k", quota)
+    take(backend, "k", quota)
+    assert not take(backend, "k", quota)[0]
+
+    clock.now += 1
+    assert take(backend, "k", quota)[0]
+    clock.now += 100
+    # Never refills past the burst size
+    assert [take(backend, "k", quota)[0] for _ in range(3)] == [True, True, False]
+
+
+def test_eviction_keeps_active_buckets():
+    backend = InMemoryRateLimitBackend(max_keys=3)
+    quota = Quota(rate=0.001, burst=1)
+    take(backend, "victim", quota)
+    for i in range(10):
+        take(backend, f"spray-{i}", quota)
+        # The victim stays active, so its exhausted bucket is never reset
+        assert not take(backend, "victim", quota)[0]
+    assert len(backend._buckets) == 3
+
+
+def test_shedder_drops_low_priority_first(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock.monotonic)
+    shedder = LoadShedder(target_latency_ms=100, max_in_flight=10, min_in_flight=2)
+    for _ in range(3):
+        shedder.started()
+    clock.now += 0.5
+    assert shedder.overloaded()
+    assert shedder.should_shed(PUBLIC_READ)
+    assert not shedder.should_shed(AUTHENTICATED)
+    assert not shedder.should_shed(AUTH)
+    assert shedder.retry_after() == 1.0
+
+
+def test_one_slow_request_does_not_trip_the_shedder(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock.monotonic)
+    shedder = LoadShedder(target_latency_ms=100, min_in_flight=2)
+    backfill = shedder.started()
+    clock.now += 60
+    fast = [shedder.started() for _ in range(5)]
+    assert not shedder.overloaded()
+    for token in fast:
+        shedder.finished(token)
+    shedder.finished(backfill)
+    assert shedder.in_flight == 0
+
+
+def test_shedder_recovers_when_slow_requests_finish(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock.monotonic)
+    shedder = LoadShedder(target_latency_ms=100, min_in_flight=2)
+    slow = [shedder.started() for _ in range(4)]
+    clock.now += 1
+    assert shedder.should_shed(PUBLIC_READ)
+    for token in slow:
+        shedder.finished(token)
+    # No further traffic is needed to stop shedding
+    assert not shedder.should_shed(PUBLIC_READ)
+
+
+def test_shedder_drops_everything_at_capacity():
+    shedder = LoadShedder(max_in_flight=2)
+    shedder.started()
+    shedder.started()
+    assert shedder.should_shed(AUTH)
+    assert shedder.should_shed(AUTHENTICATED)
+
+
+def test_classify_route():
+    assert classify_route("GET", "/api/health", None) is None
+    assert classify_route("GET", "/api/ready", None) is None
+    assert classify_route("OPTIONS", "/api/packages/create", None) is None
+    assert classify_route("POST", "/api/auth/login", "a@b.c") == AUTH
+    assert classify_route("POST", "/api/auth/register", None) == AUTH
+    assert classify_route("GET", "/api/packages/track/CD123456", None) == PUBLIC_READ
+    assert classify_route("POST", "/api/packages/create", "a@b.c") == AUTHENTICATED
+
+
+def make_client(quota, backend=None):
+    app = FastAPI()
+
+    @app.get("/api/packages/track/{tracking_id}")
+    async def track(tracking_id: str):
+        return {"tracking_id": tracking_id}
+
+    @app.post("/api/auth/{action}")
+    async def auth(action: str):
+        return {"action": action}
+
+    app.add_middleware(
+        AdmissionMiddleware,
+        backend=backend or InMemoryRateLimitBackend(),
+        quotas={PUBLIC_READ: quota, AUTHENTICATED: quota, AUTH: quota},
+        shedder=LoadShedder(),
+        identify_user=lambda request: None,
+    )
+    return TestClient(app)
+
+
+def test_middleware_rejects_with_retry_after():
+    client = make_client(Quota(rate=0.5, burst=2))
+    codes = [client.get("/api/packages/track/CD1").status_code for _ in range(3)]
+    assert codes == [200, 200, 429]
+    response = client.get("/api/packages/track/CD1")
+    assert response.headers["Retry-After"] == "2"
+
+
+def test_spoofed_forwarded_for_does_not_get_a_fresh_bucket():
+    client = make_client(Quota(rate=0.001, burst=5))
+    codes = [
+        client.get("/api/packages/track/CD1", headers={"X-Forwarded-For": f"10.0.0.{i}"}).status_code
+        for i in range(10)
+    ]
+    assert codes.count(429) == 5
+
+
+def test_login_and_register_have_separate_buckets():
+    client = make_client(Quota(rate=0.001, burst=2))
+    assert [client.post("/api/auth/register").status_code for _ in range(3)] == [200, 200, 429]
+    assert [client.post("/api/auth/login").status_code for _ in range(3)] == [200, 200, 429]
+
+
+class DownBackend:
+    async def take(self, key, quota, cost=1.0):
+        raise ServerSelectionTimeoutError("no servers")
+
+
+def test_rate_limit_store_outage_fails_open():
+    client = make_client(Quota(rate=0.001, burst=1), backend=DownBackend())
+    assert [client.get("/api/packages/track/CD1").status_code for _ in range(3)] == [200, 200, 200]
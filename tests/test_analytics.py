@@ -0,0 +1,247 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from analytics import (
+    DAY, HOUR, BackfillInProgress, BackfillLockLost, ShipmentRollups, bucket_start, status_transitions,
+)
+from tests.fake_mongo import FakeCollection, FakeDatabase
+
+
+def make_rollups():
+    db = FakeDatabase()
+    return ShipmentRollups(db.analytics_rollups, db.analytics_applied, db.analytics_meta)
+
+
+def package(package_id, created_at, service_type="standard", price=100.0, sender="Mumbai", receiver="Delhi"):
+    return {
+        "package_id": package_id,
+        "created_at": created_at,
+        "service_type": service_type,
+        "price": price,
+        "sender_city": sender,
+        "receiver_city": receiver,
+    }
+
+
+def test_bucket_start():
+    timestamp = datetime(2026, 3, 4, 10, 45, 12, 999)
+    assert bucket_start(timestamp, HOUR) == datetime(2026, 3, 4, 10)
+    assert bucket_start(timestamp, DAY) == datetime(2026, 3, 4)
+
+
+def test_query_aggregates_buckets_in_range():
+    rollups = make_rollups()
+    day1 = datetime(2026, 3, 4, 9)
+    day2 = datetime(2026, 3, 5, 15)
+    rollups.record_package_created(**package("p1", day1, "standard", 100.0))
+    rollups.record_package_created(**package("p2", day1, "express", 250.5, receiver="Pune"))
+    rollups.record_package_created(**package("p3", day2, "express", 300.0))
+    rollups.record_package_created(**package("p4", datetime(2026, 4, 1), "standard", 999.0))
+    rollups.record_status_change("e1", "delivered", day2)
+    rollups.record_status_change("e2", "delivered", day2)
+    rollups.record_status_change("e3", "returned", day2)
+    rollups.record_status_change("e4", "in_transit", day2)
+
+    result = rollups.query(datetime(2026, 3, 4), datetime(2026, 3, 6), DAY)
+
+    assert result["totals"] == {"created": 3, "revenue": 650.5, "delivered": 2, "failed": 1}
+    assert result["delivery_success_rate"] == round(2 / 3, 4)
+    assert result["created_by_service"] == {"standard": 1, "express": 2}
+    assert result["revenue_by_service"] == {"standard": 100.0, "express": 550.5}
+    assert result["top_lanes"][0] == {"lane": "mumbai->delhi", "packages": 2}
+    assert [point["bucket"] for point in result["series"]] == ["2026-03-04T00:00:00", "2026-03-05T00:00:00"]
+
+
+def test_success_rate_is_none_without_outcomes():
+    rollups = make_rollups()
+    rollups.record_package_created(**package("p1", datetime(2026, 3, 4, 9)))
+    result = rollups.query(datetime(2026, 3, 4), datetime(2026, 3, 5), HOUR)
+    assert result["delivery_success_rate"] is None
+    assert len(result["series"]) == 1
+
+
+def test_status_transitions_match_live_counting():
+    t = datetime(2026, 3, 4)
+    events = [
+        {"tracking_id": "CD1", "status": "order_placed", "timestamp": t},
+        {"tracking_id": "CD1", "status": "in_transit", "timestamp": t + timedelta(hours=1), "updated_by": "u"},
+        {"tracking_id": "CD1", "status": "in_transit", "timestamp": t + timedelta(hours=2), "updated_by": "u"},
+        {"tracking_id": "CD1", "status": "order_placed", "timestamp": t + timedelta(hours=3), "updated_by": "u"},
+        {"tracking_id": "CD1", "status": "in_transit", "timestamp": t + timedelta(hours=4), "updated_by": "u"},
+        {"tracking_id": "CD2", "status": "order_placed", "timestamp": t},
+        {"tracking_id": "CD2", "status": "delivered", "timestamp": t + timedelta(hours=5), "updated_by": "u"},
+    ]
+    assert [status for status, _ in status_transitions(events)] == ["in_transit", "order_placed", "in_transit", "delivered"]
+
+
+def test_redelivered_events_are_counted_once():
+    rollups = make_rollups()
+    timestamp = datetime(2026, 3, 4, 10, 30)
+    rollups.record_status_change("evt-1", "delivered", timestamp)
+    rollups.record_status_change("evt-1", "delivered", timestamp)
+    rollups.record_status_change("evt-2", "delivered", timestamp)
+
+    buckets = {doc["granularity"]: doc for doc in rollups.collection.docs}
+    assert buckets[HOUR]["status_changes"]["delivered"] == 2
+    assert buckets[DAY]["status_changes"]["delivered"] == 2
+
+
+def test_failed_event_is_rolled_back_and_counted_once_on_retry():
+    rollups = make_rollups()
+    original = rollups.collection.update_one
+    calls = []
+
+    def fail_second(query, update, upsert=False, session=None):
+        calls.append(query["granularity"])
+        if len(calls) == 2:
+            raise RuntimeError("connection reset")
+        return original(query, update, upsert=upsert, session=session)
+
+    rollups.collection.update_one = fail_second
+    timestamp = datetime(2026, 3, 4, 10, 30)
+    with pytest.raises(RuntimeError):
+        rollups.record_status_change("evt-1", "picked_up", timestamp)
+    # The marker and the hourly $inc were rolled back with the failed daily one
+    assert rollups.applied_collection.docs == []
+    assert rollups.collection.docs == []
+    rollups.record_status_change("evt-1", "picked_up", timestamp)
+
+    assert calls == [HOUR, DAY, HOUR, DAY]
+    assert all(doc["status_changes"]["picked_up"] == 1 for doc in rollups.collection.docs)
+
+
+def test_live_events_wait_for_running_backfill_and_skip_before_cutoff():
+    rollups = make_rollups()
+    now = datetime.utcnow()
+    rollups.meta_collection.insert_one({"_id": "backfill", "running_until": now + timedelta(minutes=5)})
+    with pytest.raises(BackfillInProgress):
+        rollups.record_status_change("e1", "delivered", now)
+
+    rollups.meta_collection.update_one({"_id": "backfill"}, {"$set": {"running_until": None, "cutoff": now}})
+    rollups.record_status_change("e2", "delivered", now - timedelta(seconds=1))
+    assert rollups.collection.docs == []
+    rollups.record_status_change("e3", "delivered", now + timedelta(seconds=1))
+    assert len(rollups.collection.docs) == 2
+
+
+def test_backfill_refuses_to_run_twice():
+    rollups = make_rollups()
+    rollups.meta_collection.insert_one({"_id": "backfill", "running_until": datetime.utcnow() + timedelta(minutes=5)})
+    assert rollups.backfill(FakeCollection(), FakeCollection()) is None
+
+
+def test_backfill_swaps_in_rebuilt_buckets(monkeypatch):
+    rollups = make_rollups()
+    db = rollups.collection.database
+    rollups.record_status_change("stale", "delivered", datetime(2026, 3, 4))
+    rebuilt = {(DAY, datetime(2026, 3, 4)): {"granularity": DAY, "bucket": datetime(2026, 3, 4), "created": 3}}
+    monkeypatch.setattr(rollups, "_build_buckets", lambda *args: rebuilt)
+
+    assert rollups.backfill(FakeCollection(), FakeCollection()) == 1
+    live = db.collections["analytics_rollups"]
+    assert [doc["created"] for doc in live.docs] == [3]
+    state = rollups.meta_collection.find_one({"_id": "backfill"})
+    assert state["running_until"] is None and state["cutoff"] is not None
+
+
+def test_backfill_lock_is_renewed_while_running_and_released_on_failure(monkeypatch):
+    rollups = make_rollups()
+    rollups.backfill_lock_seconds = 0.3
+    seen = {}
+
+    def slow_build(*args):
+        time.sleep(0.6)
+        seen["running"] = rollups.backfill_running()
+        raise RuntimeError("cursor killed")
+
+    monkeypatch.setattr(rollups, "_build_buckets", slow_build)
+    with pytest.raises(RuntimeError):
+        rollups.backfill(FakeCollection(), FakeCollection())
+    # Past the original 0.3s lock, but the heartbeat kept it held
+    assert seen["running"] is True
+    assert not rollups.backfill_running()
+
+
+def test_backfill_does_not_swap_after_losing_its_lock(monkeypatch):
+    rollups = make_rollups()
+    rollups.record_status_change("live", "delivered", datetime(2026, 3, 4))
+
+    def build_then_lose_lock(*args):
+        rollups.meta_collection.update_one({"_id": "backfill"}, {"$set": {"owner": "someone-else"}})
+        return {}
+
+    monkeypatch.setattr(rollups, "_build_buckets", build_then_lose_lock)
+    with pytest.raises(BackfillLockLost):
+        rollups.backfill(FakeCollection(), FakeCollection())
+    assert len(rollups.collection.database.collections["analytics_rollups"].docs) == 2
+
+
+class StubRollups:
+    def __init__(self):
+        self.calls = []
+        self.running = False
+
+    def backfill_running(self):
+        return self.running
+
+    def query(self, start, end, granularity):
+        self.calls.append((start, end, granularity))
+        return {"start": start.isoformat(), "end": end.isoformat()}
+
+
+@pytest.fixture
+def analytics_client():
+    app = server.create_app()
+    rollups = StubRollups()
+    app.state.services.analytics_rollups = rollups
+    app.dependency_overrides[server.get_current_user] = lambda: {"role": "admin", "user_id": "admin"}
+    return TestClient(app), rollups
+
+
+def test_endpoint_normalises_aware_dates_to_naive_utc(analytics_client):
+    client, rollups = analytics_client
+    response = client.get("/api/admin/analytics", params={"start": "2026-01-01T05:30:00+05:30", "end": "2026-01-02T00:00:00Z"})
+    assert response.status_code == 200
+    start, end, granularity = rollups.calls[0]
+    assert start == datetime(2026, 1, 1) and start.tzinfo is None
+    assert end == datetime(2026, 1, 2) and end.tzinfo is None
+
+
+def test_endpoint_mixes_aware_start_with_default_end(analytics_client):
+    client, rollups = analytics_client
+    response = client.get("/api/admin/analytics", params={"start": "2026-01-01T00:00:00Z"})
+    assert response.status_code == 200
+
+
+def test_endpoint_rejects_bad_input(analytics_client):
+    client, _ = analytics_client
+    assert client.get("/api/admin/analytics", params={"start": "yesterday"}).status_code == 400
+    assert client.get("/api/admin/analytics", params={"granularity": "week"}).status_code == 400
+    assert client.get("/api/admin/analytics", params={"start": "2026-02-01", "end": "2026-01-01"}).status_code == 400
+
+
+class StubQueue:
+    def __init__(self):
+        self.enqueued = []
+
+    async def enqueue(self, name, payload=None, durable=True, delay=0):
+        self.enqueued.append(name)
+        return "job-1"
+
+
+def test_backfill_endpoint_queues_a_job(analytics_client):
+    client, rollups = analytics_client
+    queue = StubQueue()
+    client.app.state.services.job_queue = queue
+    response = client.post("/api/admin/analytics/backfill")
+    assert response.status_code == 202
+    assert response.json()["job_id"] == "job-1"
+    assert queue.enqueued == ["backfill_analytics"]
+
+    rollups.running = True
+    assert client.post("/api/admin/analytics/backfill").status_code == 409
+    assert queue.enqueued == ["backfill_analytics"]
@@ -0,0 +1,210 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from jobs import COMPLETED, DEAD, QUEUED, RUNNING, JobQueue, RetryLater
+from tasks import package_created_payload, register_tasks
+from tests.fake_mongo import FakeCollection
+
+
+def make_queue(**kwargs):
+    kwargs.setdefault("backoff_base", 10)
+    return JobQueue(FakeCollection("jobs"), FakeCollection("dead_letter_jobs"), **kwargs)
+
+
+def stored(queue, job_id):
+    return queue.collection.find_one({"job_id": job_id})
+
+
+def make_due(queue, job_id):
+    queue.collection.update_one({"job_id": job_id}, {"$set": {"run_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_failed_job_is_retried_with_exponential_backoff():
+    queue = make_queue(max_attempts=5)
+
+    def flaky():
+        raise ValueError("boom")
+
+    queue.register("flaky", flaky)
+
+    async def scenario():
+        job_id = await queue.enqueue("flaky")
+        delays = []
+        for _ in range(3):
+            make_due(queue, job_id)
+            before = datetime.utcnow()
+            await queue._run(queue._claim())
+            job = stored(queue, job_id)
+            delays.append(round((job["run_at"] - before).total_seconds()))
+        return stored(queue, job_id), delays
+
+    job, delays = asyncio.run(scenario())
+    assert delays == [10, 20, 40]
+    assert job["status"] == QUEUED
+    assert job["attempts"] == 3
+    assert "boom" in job["last_error"]
+    assert "lease_id" not in job and "locked_until" not in job
+
+
+def test_job_is_dead_lettered_after_max_attempts():
+    queue = make_queue(max_attempts=2)
+    queue.register("broken", lambda: 1 / 0)
+
+    async def scenario():
+        job_id = await queue.enqueue("broken", {})
+        for _ in range(2):
+            make_due(queue, job_id)
+            await queue._run(queue._claim())
+        return job_id
+
+    job_id = asyncio.run(scenario())
+    assert stored(queue, job_id)["status"] == DEAD
+    dead = queue.dead_letter_collection.find_one({"job_id": job_id})
+    assert dead["attempts"] == 2
+    assert "ZeroDivisionError" in dead["last_error"]
+    assert queue._claim() is None
+
+
+def test_expired_lease_is_reclaimed_and_stale_worker_is_fenced_off():
+    queue = make_queue()
+    queue.register("noop", lambda: None)
+
+    async def scenario():
+        job_id = await queue.enqueue("noop")
+        first = queue._claim()
+        assert queue._claim() is None  # lease still held
+        queue.collection.update_one({"job_id": job_id}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+        second = queue._claim()
+        assert second["attempts"] == 2
+        assert second["lease_id"] != first["lease_id"]
+
+        # The stale worker finishes late: its completion must not touch the new run
+        await queue._completed(first)
+        assert stored(queue, job_id)["status"] == RUNNING
+        await queue._failed(dict(first, attempts=queue.max_attempts), "late failure")
+        assert queue.dead_letter_collection.docs == []
+
+        await queue._completed(second)
+        return stored(queue, job_id)
+
+    assert asyncio.run(scenario())["status"] == COMPLETED
+
+
+def test_heartbeat_keeps_long_jobs_leased():
+    queue = make_queue(lease_seconds=0.3)
+
+    async def slow():
+        await asyncio.sleep(0.5)
+
+    queue.register("slow", slow)
+
+    async def scenario():
+        job_id = await queue.enqueue("slow")
+        run = asyncio.create_task(queue._run(queue._claim()))
+        await asyncio.sleep(0.4)
+        # Past the original lease, but the heartbeat renewed it
+        reclaimed = queue._claim()
+        await run
+        return job_id, reclaimed
+
+    job_id, reclaimed = asyncio.run(scenario())
+    assert reclaimed is None
+    assert stored(queue, job_id)["status"] == COMPLETED
+
+
+def test_retry_later_requeues_without_using_an_attempt():
+    queue = make_queue(max_attempts=1)
+
+    def waiting():
+        raise RetryLater(delay=30)
+
+    queue.register("waiting", waiting)
+
+    async def scenario():
+        job_id = await queue.enqueue("waiting")
+        await queue._run(queue._claim())
+        return stored(queue, job_id)
+
+    job = asyncio.run(scenario())
+    assert job["status"] == QUEUED
+    assert job["attempts"] == 0
+    assert queue.dead_letter_collection.docs == []
+
+
+def test_close_hands_back_jobs_still_running():
+    queue = make_queue(workers=1, poll_interval=0.05)
+
+    async def stuck():
+        await asyncio.sleep(10)
+
+    queue.register("stuck", stuck)
+
+    async def scenario():
+        job_id = await queue.enqueue("stuck")
+        queue.start()
+        await asyncio.sleep(0.1)
+        assert stored(queue, job_id)["status"] == RUNNING
+        await queue.close(timeout=0.05)
+        return stored(queue, job_id)
+
+    job = asyncio.run(scenario())
+    assert job["status"] == QUEUED
+    assert job["attempts"] == 0
+    assert "lease_id" not in job
+
+
+def test_memory_jobs_run_through_workers():
+    queue = make_queue(workers=2, poll_interval=0.05)
+    seen = []
+    queue.register("record", lambda value: seen.append(value))
+
+    async def scenario():
+        queue.start()
+        job_id = await queue.enqueue("record", {"value": 7}, durable=False)
+        await asyncio.sleep(0.1)
+        await queue.close()
+        return queue.get(job_id)
+
+    assert asyncio.run(scenario())["status"] == COMPLETED
+    assert seen == [7]
+
+
+
+def test_stats_counts_each_status():
+    queue = make_queue()
+    queue.register("noop", lambda: None)
+
+    async def scenario():
+        await queue.enqueue("noop")
+        await queue.enqueue("noop")
+        await queue._run(queue._claim())
+
+    asyncio.run(scenario())
+    assert queue.stats()["durable"] == {QUEUED: 1, RUNNING: 0, COMPLETED: 1, DEAD: 0}
+
+
+class RecordingRollups:
+    def __init__(self):
+        self.created = []
+
+    def record_package_created(self, package_id, **fields):
+        self.created.append(dict(fields, package_id=package_id))
+
+
+def test_package_created_job_uses_its_payload():
+    queue = make_queue()
+    packages = FakeCollection("packages")
+    rollups = RecordingRollups()
+    register_tasks(queue, packages, FakeCollection("tracking"), rollups)
+    package = {
+        "package_id": "p1", "created_at": datetime(2026, 3, 4), "service_type": "express", "price": 99.5,
+        "sender": {"city": "Mumbai"}, "receiver": {"city": "Pune"},
+    }
+
+    # The package isn't stored, so the job can only have used the payload
+    queue.handlers["record_package_created"](**package_created_payload(package))
+    packages.insert_one(dict(package))
+    # Jobs queued with only the package id still work
+    queue.handlers["record_package_created"](package_id="p1")
+
+    assert rollups.created[0] == rollups.created[1] == package_created_payload(package)
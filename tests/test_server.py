@@ -0,0 +1,150 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+import launcher
+import server
+from tests.fake_mongo import FakeCollection
+
+
+class StubServices:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.pings = 0
+
+    def ping(self):
+        self.pings += 1
+        if not self.healthy:
+            raise ServerSelectionTimeoutError("no servers")
+
+
+def make_client(services, ready=True):
+    app = server.create_app()
+    app.state.services = services
+    app.state.ready = ready
+    # No `with` block: the lifespan (Mongo warm-up) does not run
+    return TestClient(app)
+
+
+def test_live_does_not_touch_mongo():
+    services = StubServices(healthy=False)
+    response = make_client(services).get("/api/live")
+    assert response.status_code == 200
+    assert response.json() == {"status": "alive"}
+    assert services.pings == 0
+
+
+def test_ready_when_mongo_answers():
+    services = StubServices()
+    response = make_client(services).get("/api/ready")
+    assert response.status_code == 200
+    assert services.pings == 1
+
+
+def test_not_ready_when_mongo_is_down():
+    response = make_client(StubServices(healthy=False)).get("/api/ready")
+    assert response.status_code == 503
+    assert response.json()["reason"] == "database unavailable"
+
+
+def test_not_ready_while_starting_or_draining():
+    services = StubServices()
+    response = make_client(services, ready=False).get("/api/ready")
+    assert response.status_code == 503
+    assert services.pings == 0
+
+
+def test_apps_keep_their_own_services():
+    first = server.create_app()
+    second = server.create_app()
+    assert first.state.services is not second.state.services
+    assert first.state.services.client is not second.state.services.client
+
+
+def test_probe_client_uses_short_timeouts():
+    services = server.Services()
+    options = services.probe_client.options
+    assert options.server_selection_timeout == server.PROBE_TIMEOUT_MS / 1000
+    assert options.pool_options.socket_timeout == server.PROBE_TIMEOUT_MS / 1000
+
+
+def test_draining_server_reports_not_ready_before_exit():
+    app = server.create_app()
+    app.state.ready = True
+    config = launcher.uvicorn.Config(app)
+    drainer = launcher.DrainingServer(config, app, drain_delay=0.05)
+
+    async def run():
+        drainer.handle_exit(15, None)
+        assert app.state.ready is False
+        assert drainer.should_exit is False
+        await asyncio.sleep(0.1)
+        assert drainer.should_exit is True
+
+    asyncio.run(run())
+
+
+
+class ShutdownStub:
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    def start(self):
+        pass
+
+    async def close(self, **kwargs):
+        self.calls.append((self.name, kwargs))
+
+
+class LifespanServices:
+    def __init__(self):
+        self.calls = []
+        self.tracking_buffer = ShutdownStub("tracking_buffer", self.calls)
+        self.job_queue = ShutdownStub("job_queue", self.calls)
+
+    def warm_up(self):
+        pass
+
+    def close(self):
+        self.calls.append(("client", {}))
+
+
+def test_shutdown_flushes_tracking_before_stopping_jobs():
+    app = server.create_app()
+    services = LifespanServices()
+    app.state.services = services
+    app.state.job_shutdown_timeout = 3
+
+    async def run():
+        async with server.lifespan(app):
+            assert app.state.ready is True
+        assert app.state.ready is False
+
+    asyncio.run(run())
+    assert services.calls == [("tracking_buffer", {}), ("job_queue", {"timeout": 3}), ("client", {})]
+
+
+class FailingQueue:
+    async def enqueue(self, name, payload=None, durable=True, delay=0):
+        raise ServerSelectionTimeoutError("no servers")
+
+
+def test_package_is_created_even_if_follow_up_job_cannot_be_queued():
+    app = server.create_app()
+    services = app.state.services
+    services.packages_collection = FakeCollection("packages")
+    services.tracking_collection = FakeCollection("tracking")
+    services.job_queue = FailingQueue()
+    app.dependency_overrides[server.get_current_user] = lambda: {"role": "customer", "user_id": "u1"}
+    address = {"name": "A", "phone": "1", "address": "x", "city": "Mumbai", "state": "MH", "postal_code": "400001"}
+    response = TestClient(app).post("/api/packages/create", json={
+        "sender": address,
+        "receiver": dict(address, city="Pune"),
+        "package_details": {"type": "parcel", "weight": 1, "length": 10, "width": 10, "height": 10, "description": "box"},
+        "service_type": "standard",
+        "pickup_date": "2026-03-04",
+    })
+    assert response.status_code == 200
+    assert len(services.packages_collection.docs) == 1
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from tests.fake_mongo import FakeCollection
+from write_buffer import GroupCommitBuffer, WriteBufferClosed
+
+
+class BatchCollection(FakeCollection):
+    """Records each insert_many batch and can inject bulk write errors or stall."""
+
+    def __init__(self, fail_indexes=(), write_concern_error=False):
+        super().__init__("tracking")
+        self.batches = []
+        self.fail_indexes = set(fail_indexes)
+        self.write_concern_error = write_concern_error
+        self.release = threading.Event()
+        self.release.set()
+
+    def insert_many(self, docs, ordered=True):
+        assert ordered is False
+        self.release.wait()
+        self.batches.append([doc["n"] for doc in docs])
+        for doc in docs:
+            doc["_id"] = doc["n"]
+        super().insert_many([doc for index, doc in enumerate(docs) if index not in self.fail_indexes], ordered)
+        details = {"writeErrors": [], "writeConcernErrors": []}
+        if self.fail_indexes:
+            details["writeErrors"] = [{"index": i, "code": 11000, "errmsg": "duplicate key"} for i in sorted(self.fail_indexes)]
+        if self.write_concern_error:
+            details["writeConcernErrors"] = [{"code": 64, "errmsg": "waiting for replication timed out"}]
+        if details["writeErrors"] or details["writeConcernErrors"]:
+            raise BulkWriteError(details)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_batches_by_size():
+    async def scenario():
+        collection = BatchCollection()
+        buffer = GroupCommitBuffer(collection, max_batch=10, max_delay_ms=50)
+        buffer.start()
+        ids = await asyncio.gather(*[buffer.insert({"n": i}) for i in range(25)])
+        await buffer.close()
+        return collection, ids
+
+    collection, ids = run(scenario())
+    assert [len(batch) for batch in collection.batches] == [10, 10, 5]
+    assert ids == list(range(25))
+
+
+def test_flushes_partial_batch_after_deadline():
+    async def scenario():
+        collection = BatchCollection()
+        buffer = GroupCommitBuffer(collection, max_batch=100, max_delay_ms=5)
+        buffer.start()
+        await asyncio.wait_for(buffer.insert({"n": 1}), timeout=1)
+        batches = list(collection.batches)
+        await buffer.close()
+        return batches
+
+    assert run(scenario()) == [[1]]
+
+
+def test_deadline_counts_from_enqueue_time():
+    async def scenario():
+        collection = BatchCollection()
+        collection.release.clear()
+        buffer = GroupCommitBuffer(collection, max_batch=100, max_delay_ms=300)
+        buffer.start()
+        first = asyncio.create_task(buffer.insert({"n": 1}))
+        await asyncio.sleep(0.35)
+        # The first batch is stuck in insert_many while the second document queues up
+        second = asyncio.create_task(buffer.insert({"n": 2}))
+        await asyncio.sleep(0.4)
+        collection.release.set()
+        released = asyncio.get_running_loop().time()
+        await first
+        await second
+        waited = asyncio.get_running_loop().time() - released
+        await buffer.close()
+        return collection.batches, waited
+
+    batches, waited = run(scenario())
+    assert batches == [[1], [2]]
+    # It already waited past max_delay_ms in the queue, so it is flushed without a fresh delay
+    assert waited < 0.2
+
+
+def test_per_document_errors_fail_only_their_caller():
+    async def scenario():
+        collection = BatchCollection(fail_indexes={1})
+        buffer = GroupCommitBuffer(collection, max_batch=3, max_delay_ms=50)
+        buffer.start()
+        results = await asyncio.gather(*[buffer.insert({"n": i}) for i in range(3)], return_exceptions=True)
+        await buffer.close()
+        return results
+
+    results = run(scenario())
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], BulkWriteError)
+
+
+def test_write_concern_error_fails_every_caller():
+    async def scenario():
+        collection = BatchCollection(write_concern_error=True)
+        buffer = GroupCommitBuffer(collection, max_batch=3, max_delay_ms=50)
+        buffer.start()
+        results = await asyncio.gather(*[buffer.insert({"n": i}) for i in range(3)], return_exceptions=True)
+        await buffer.close()
+        return results
+
+    assert all(isinstance(result, BulkWriteError) for result in run(scenario()))
+
+
+def test_close_flushes_queued_documents_and_rejects_new_ones():
+    async def scenario():
+        collection = BatchCollection()
+        buffer = GroupCommitBuffer(collection, max_batch=100, max_delay_ms=10000)
+        buffer.start()
+        pending = [asyncio.create_task(buffer.insert({"n": i})) for i in range(5)]
+        await asyncio.sleep(0)
+        await buffer.close()
+        with pytest.raises(WriteBufferClosed):
+            await buffer.insert({"n": 99})
+        return collection, await asyncio.gather(*pending)
+
+    collection, ids = run(scenario())
+    assert sorted(n for batch in collection.batches for n in batch) == [0, 1, 2, 3, 4]
+    assert ids == [0, 1, 2, 3, 4]
+
+
+def test_backpressure_bounds_pending_documents():
+    async def scenario():
+        collection = BatchCollection()
+        collection.release.clear()
+        buffer = GroupCommitBuffer(collection, max_batch=2, max_delay_ms=1, max_pending=4)
+        buffer.start()
+        tasks = [asyncio.create_task(buffer.insert({"n": i})) for i in range(10)]
+        await asyncio.sleep(0.05)
+        # Mongo is stalled: only max_pending documents were admitted, the rest wait for room
+        admitted = buffer.max_pending - buffer._slots._value
+        queued = buffer._queue.qsize()
+        collection.release.set()
+        await asyncio.gather(*tasks)
+        await buffer.close()
+        return admitted, queued, collection
+
+    admitted, queued, collection = run(scenario())
+    assert admitted == 4
+    assert queued <= 4
+    assert sorted(n for batch in collection.batches for n in batch) == list(range(10))